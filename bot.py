@@ -64,7 +64,10 @@
 
 from ast import literal_eval
 import asyncio
-from datetime import datetime, timezone
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from itertools import chain
 import os
 import time
 import random
@@ -113,10 +116,12 @@ with open(file=CFG_PATH, mode="r", encoding="utf-8") as f_config:
 assert CFG is not None
 
 
+@lru_cache(maxsize=None)
 def cfg(key):
     """Returns a bot config value from environment variable or config file,
        in that order. If using an env var, its format has to match the type
        determined by the config values' StrictYAML schema.
+       The results are cached, since the config doesn't change at runtime.
     """
     assert isinstance(key, str)
     if os.environ.get(key):
@@ -133,7 +138,8 @@ def cfg(key):
     return CFG[key].value
 
 
-bot = commands.Bot(command_prefix=cfg("NTBOT_CMD_PREFIX"),
+CMD_PREFIX = cfg("NTBOT_CMD_PREFIX")
+bot = commands.Bot(command_prefix=CMD_PREFIX,
                    case_insensitive=True)
 NUM_PLAYERS_REQUIRED = cfg("NTBOT_PLAYERS_REQUIRED_TOTAL")
 assert NUM_PLAYERS_REQUIRED > 0, "Need positive number of players"
@@ -141,9 +147,28 @@ assert NUM_PLAYERS_REQUIRED % 2 == 0, "Need even number of players"
 DEBUG_ALLOW_REQUEUE = cfg("NTBOT_DEBUG_ALLOW_REQUEUE")
 PUG_CHANNEL_NAME = cfg("NTBOT_PUG_CHANNEL")
 BOT_SECRET_TOKEN = cfg("NTBOT_SECRET_TOKEN")
-assert 0 <= cfg("NTBOT_PUGGER_ROLE_PING_THRESHOLD") <= 1
 PUGGER_ROLE = cfg("NTBOT_PUGGER_ROLE")
 assert len(PUGGER_ROLE) > 0
+PUGGER_ROLE_PING_THRESHOLD = cfg("NTBOT_PUGGER_ROLE_PING_THRESHOLD")
+assert 0 <= PUGGER_ROLE_PING_THRESHOLD <= 1
+PUGGER_ROLE_PING_MIN_INTERVAL_HOURS = cfg(
+    "NTBOT_PUGGER_ROLE_PING_MIN_INTERVAL_HOURS")
+PUGGER_ROLE_PING_MIN_INTERVAL = timedelta(
+    hours=PUGGER_ROLE_PING_MIN_INTERVAL_HOURS)
+PING_PUGGERS_COOLDOWN_SECS = cfg("NTBOT_PING_PUGGERS_COOLDOWN_SECS")
+IDLE_THRESHOLD_HOURS = cfg("NTBOT_IDLE_THRESHOLD_HOURS")
+assert IDLE_THRESHOLD_HOURS > 0
+# The list preserves the configured order for displaying in messages.
+PUG_ADMIN_ROLE_NAMES = [role.value for role in cfg("NTBOT_PUG_ADMIN_ROLES")]
+PUG_ADMIN_ROLES = frozenset(PUG_ADMIN_ROLE_NAMES)
+
+POLLING_INTERVAL_SECS = cfg("NTBOT_POLLING_INTERVAL_SECS")
+# Queue fill ratio above which the queues are polled at the configured rate,
+# and the interval multipliers for partially filled and empty queues.
+POLLING_BUSY_FILL_RATIO = 0.75
+POLLING_PARTIAL_INTERVAL_MULTIPLIER = 2
+POLLING_IDLE_INTERVAL_MULTIPLIER = 4
+PRESENCE_INTERVAL_SECS = cfg("NTBOT_PRESENCE_INTERVAL_SECS")
 
 FIRST_TEAM_NAME = cfg("NTBOT_FIRST_TEAM_NAME")
 SECOND_TEAM_NAME = cfg("NTBOT_SECOND_TEAM_NAME")
@@ -152,9 +177,42 @@ SECOND_TEAM_NAME = cfg("NTBOT_SECOND_TEAM_NAME")
 # when restoring status during restart.
 PUG_READY_TITLE = "**PUG is now ready!**"
 
+# The command prefix can't change at runtime, so format it into these once.
+PUG_CMD = f"{CMD_PREFIX}pug"
+UNPUG_CMD = f"{CMD_PREFIX}unpug"
+ALREADY_QUEUED_TEMPLATE = ("{mention} You are already queued! If you "
+                           f"wanted to un-PUG, please use **{UNPUG_CMD}** "
+                           "instead.")
+PUG_READY_FOOTER = (f"\n\nTeams unbalanced? Use **{CMD_PREFIX}scramble** to "
+                    "suggest new random teams.")
+SCRAMBLE_FOOTER = ("\n\nTeams still unbalanced? Use "
+                   f"**{CMD_PREFIX}scramble** to suggest new random teams.")
+
+# Reply templates for joining and leaving the PUG queue.
+JOINED_QUEUE_TEMPLATE = ("{name} has joined the PUG queue "
+                         "({queued} / {expected})")
+LEFT_QUEUE_TEMPLATE = "{name} has left the PUG queue ({queued} / {expected})"
+
+# Message template for the automatic pugger role pings.
+PUGGER_ROLE_PING_TEMPLATE = (
+    "{mention} Need **{num_needed} more puggers** for a game!\n"
+    "_(This is an automatic ping to all puggers, because the PUG queue is "
+    "{percent:.0f}% full.\nRest assured, I will only ping you once per "
+    "{min_nag_hours} hours, at most.\nIf you don't want any of these "
+    "notifications, please consider temporarily muting this bot or leaving "
+    "the {mention} server role._)")
+
 print(f"Now running {SCRIPT_NAME} v.{SCRIPT_VERSION}", flush=True)
 
 
+@lru_cache(maxsize=64)
+def presence_activity(activity_type, text):
+    """Returns a Discord activity of the given type and text. Cached, since
+       the presence text only has a handful of possible values.
+    """
+    return discord.Activity(type=activity_type, name=text)
+
+
 class PugStatus():
     """Object for containing and operating on one Discord server's PUG
        information.
@@ -164,49 +222,83 @@ class PugStatus():
     def __init__(self, guild_channel, players_required=NUM_PLAYERS_REQUIRED,
                  guild_roles=None):
         self.guild_roles = [] if guild_roles is None else guild_roles
+        # The role lookup is cached, since we need it on every queue poll.
+        self.pugger_role = discord.utils.get(self.guild_roles,
+                                             name=PUGGER_ROLE)
         self.guild_channel = guild_channel
         self.team1_players = []
         self.team2_players = []
+        # Discord user ids of everyone in either team, for fast lookups.
+        self.queued_ids = set()
         self.prev_puggers = []
         self.players_required_total = players_required
         assert self.players_required_total >= 2
         assert self.players_required_total % 2 == 0
-        self.last_changed_presence = 0
+        # Players required to start a PUG, per team.
+        self.players_per_team = self.players_required_total // 2
+        # Monotonic time of the latest presence change, None if unthrottled.
+        self.last_changed_presence = None
         self.last_presence = None
+        # Whether the queue has changed since the presence was last updated.
+        self.dirty = True
         self.lock = asyncio.Lock()
+        # Separate lock for the whole PUG start sequence, which awaits
+        # several of the methods that acquire self.lock.
+        self.start_lock = asyncio.Lock()
+
+    def update_guild_roles(self, guild_roles):
+        """Updates the guild roles, and the cached pugger role among them."""
+        self.guild_roles = guild_roles
+        self.pugger_role = discord.utils.get(guild_roles, name=PUGGER_ROLE)
 
     async def reset(self):
         """Stores the previous puggers, and then resets current pugger queue.
         """
         async with self.lock:
-            self.prev_puggers = self.team1_players + self.team2_players
-            self.team1_players.clear()
-            self.team2_players.clear()
+            self._reset_locked()
+
+    def _reset_locked(self):
+        """reset(), for callers already holding self.lock."""
+        self.prev_puggers = self.team1_players + self.team2_players
+        self.team1_players.clear()
+        self.team2_players.clear()
+        self.queued_ids.clear()
+        self.dirty = True
 
     async def player_join(self, player, team=None):
         """If there is enough room in this PUG queue, assigns this player
-           to a random team to wait in, until the PUG is ready to be started.
+           to a team to wait in, until the PUG is ready to be started.
+           Unless a team is specified, the team with fewer players is chosen,
+           or a random one if both teams are equally sized.
            The specific team rosters can later be shuffled by a !scramble.
         """
         async with self.lock:
-            if not DEBUG_ALLOW_REQUEUE and \
-                    (player in self.team1_players or
-                     player in self.team2_players):
-                return False, (f"{player.mention} You are already queued! "
-                               "If you wanted to un-PUG, please use **"
-                               f"{bot.command_prefix}unpug** "
-                               "instead.")
-            if team is None:
-                team = random.randint(0, 1)  # flip a coin between team1/team2
-            if team == 0:
-                if len(self.team1_players) < self.players_per_team:
-                    self.team1_players.append(player)
-                    return True, ""
-            if len(self.team2_players) < self.players_per_team:
-                self.team2_players.append(player)
+            return self._player_join_locked(player, team)
+
+    def _player_join_locked(self, player, team=None):
+        """player_join(), for callers already holding self.lock."""
+        if not DEBUG_ALLOW_REQUEUE and self.is_queued(player):
+            return False, ALREADY_QUEUED_TEMPLATE.format(
+                mention=player.mention)
+        if team is None:
+            num_team1 = len(self.team1_players)
+            num_team2 = len(self.team2_players)
+            if num_team1 != num_team2:
+                team = 0 if num_team1 < num_team2 else 1
+            else:
+                team = random.getrandbits(1)  # flip a coin between teams
+        if team == 0:
+            if len(self.team1_players) < self.players_per_team:
+                self.team1_players.append(player)
+                self.queued_ids.add(player.id)
+                self.dirty = True
                 return True, ""
-            return False, (f"{player.mention} Sorry, this PUG is currently "
-                           "full!")
+        if len(self.team2_players) < self.players_per_team:
+            self.team2_players.append(player)
+            self.queued_ids.add(player.id)
+            self.dirty = True
+            return True, ""
+        return False, f"{player.mention} Sorry, this PUG is currently full!"
 
     async def reload_puggers(self):
         """Iterate PUG channel's recent message history to figure out who
@@ -214,17 +306,12 @@ class PugStatus():
            bot restart, but also for dropping inactive players from the queue
            after inactivity of "NTBOT_IDLE_THRESHOLD_HOURS" period.
         """
-        limit_hrs = cfg("NTBOT_IDLE_THRESHOLD_HOURS")
-        assert limit_hrs > 0
-        after = pendulum.now().subtract(hours=limit_hrs)
+        after = pendulum.now().subtract(hours=IDLE_THRESHOLD_HOURS)
         # Because Pycord 1.7.3 wants non timezone aware "after" date.
         after = datetime.fromisoformat(after.in_timezone("UTC").isoformat())
         after = after.replace(tzinfo=None)
 
-        def is_cmd(msg, cmd):
-            """Predicate for whether message equals a specific PUG command.
-            """
-            return msg.content == f"{bot.command_prefix}{cmd}"
+        queue_cmds = frozenset((PUG_CMD, UNPUG_CMD))
 
         def is_pug_reset(msg):
             """Predicate for whether a message signals PUG reset.
@@ -237,56 +324,60 @@ class PugStatus():
             """
             return msg.author.bot and msg.content.startswith(PUG_READY_TITLE)
 
-        backup_team2 = self.team2_players.copy()
-        backup_team1 = self.team1_players.copy()
-        backup_prev = self.prev_puggers.copy()
-        try:
+        def is_queue_event(msg):
+            """Predicate for whether a message affects the PUG queue."""
+            return (msg.content in queue_cmds or is_pug_reset(msg) or
+                    is_pug_start(msg))
+
+        # We remove the default max retrieved messages history limit because
+        # we need to always retrieve the full order of events here. This can
+        # be a slow operation if the channel is heavily congested within the
+        # "now-after" search range, but it's acceptable here because this code
+        # only runs on bot init, and then once per clear_inactive_puggers()
+        # task loop period, which is at most once per hour.
+        # Discord frequently HTTP 500's, and we can also hit a HTTP 429 here,
+        # which might be a pycord bug(?) as I don't think we're being
+        # unreasonable with the history range. Since the queue is only touched
+        # once the whole history has been fetched, it's left as is on errors.
+        events = [msg async for msg in self.guild_channel.history(
+            limit=None, after=after, oldest_first=True).filter(is_queue_event)]
+
+        # Not holding the lock for the fetch, since any queue commands issued
+        # in the meantime are in the fetched history, and get replayed too.
+        async with self.lock:
             # First reset the PUG queue, and then replay the pug/unpug traffic
-            # within the acceptable "restore_puggers_limit_hours" history range
-            await self.reset()
-            # We remove the default max retrieved messages history limit
-            # because we need to always retrieve the full order of events here.
-            # This can be a slow operation if the channel is heavily congested
-            # within the "now-after" search range, but it's acceptable here
-            # because this code only runs on bot init, and then once per
-            # clear_inactive_puggers() task loop period, which is at most once
-            # per hour.
-            async for msg in self.guild_channel.history(limit=None,
-                                                        after=after,
-                                                        oldest_first=True).\
-                    filter(lambda msg: any((is_cmd(msg, "pug"),
-                                            is_cmd(msg, "unpug"),
-                                            is_pug_reset(msg),
-                                            is_pug_start(msg)))):
-                if is_pug_reset(msg) or is_pug_start(msg):
-                    await self.reset()
-                elif is_cmd(msg, "pug"):
-                    await self.player_join(msg.author)
+            # within the acceptable "restore_puggers_limit_hours" history
+            # range.
+            self._reset_locked()
+            for msg in events:
+                if msg.content == PUG_CMD:
+                    self._player_join_locked(msg.author)
+                elif msg.content in queue_cmds:
+                    self._player_leave_locked(msg.author)
                 else:
-                    await self.player_leave(msg.author)
-        # Discord frequently HTTP 500's, so need to have pug queue backups.
-        # We can also hit a HTTP 429 here, which might be a pycord bug(?)
-        # as I don't think we're being unreasonable with the history range.
-        except discord.errors.HTTPException as err:
-            self.team2_players = backup_team2.copy()
-            self.team1_players = backup_team1.copy()
-            self.prev_puggers = backup_prev.copy()
-            raise err
+                    self._reset_locked()
 
     async def player_leave(self, player):
         """Removes a player from the pugger queue if they were in it.
         """
         async with self.lock:
-            num_before = self.num_queued
-            self.team1_players = [p for p in self.team1_players if p != player]
-            self.team2_players = [p for p in self.team2_players if p != player]
-            num_after = self.num_queued
-
-            left_queue = (num_after != num_before)
-            if left_queue:
-                return True, ""
-            return False, (f"{player.mention} You are not currently in the "
-                           "PUG queue")
+            return self._player_leave_locked(player)
+
+    def _player_leave_locked(self, player):
+        """player_leave(), for callers already holding self.lock."""
+        if not self.is_queued(player):
+            return False, (f"{player.mention} You are not currently in "
+                           "the PUG queue")
+        self.team1_players = [p for p in self.team1_players if p != player]
+        self.team2_players = [p for p in self.team2_players if p != player]
+        self.queued_ids.discard(player.id)
+        self.dirty = True
+        return True, ""
+
+    def is_queued(self, player):
+        """Whether the player is currently in either team of the PUG queue.
+        """
+        return player.id in self.queued_ids
 
     @property
     def num_queued(self):
@@ -300,13 +391,6 @@ class PugStatus():
         """
         return self.players_required_total
 
-    @property
-    def players_per_team(self):
-        """Players required to start a PUG, per team."""
-        res = self.num_expected / 2
-        assert res % 1 == 0, "Must be whole number"
-        return int(res)
-
     @property
     def num_more_needed(self):
         """Returns how many more puggers are needed to start a PUG.
@@ -323,30 +407,56 @@ class PugStatus():
         """
         async with self.lock:
             if len(self.team1_players) == 0 or len(self.team2_players) == 0:
-                await self.reset()
+                self._reset_locked()
                 return False, "Error: team was empty"
             msg = f"{PUG_READY_TITLE}\n"
             msg += "\n_" + FIRST_TEAM_NAME + " players:_\n"
-            for player in self.team1_players:
-                msg += f"{player.mention}, "
-            msg = msg[:-2]  # trailing ", "
+            msg += ", ".join(player.mention for player in self.team1_players)
             msg += "\n_" + SECOND_TEAM_NAME + " players:_\n"
-            for player in self.team2_players:
-                msg += f"{player.mention}, "
-            msg = msg[:-2]  # trailing ", "
-            msg += ("\n\nTeams unbalanced? Use **"
-                    f"{bot.command_prefix}scramble** to suggest new "
-                    "random teams.")
+            msg += ", ".join(player.mention for player in self.team2_players)
+            msg += PUG_READY_FOOTER
             return True, msg
 
+    async def start_pug_if_full(self):
+        """If the PUG queue is full, starts and announces the PUG, and resets
+           the queue for the next one. Returns whether a PUG was started.
+        """
+        async with self.start_lock:
+            # Both the pug command and the poll_queue task loop can get here,
+            # so check again now that we're holding the lock.
+            if not self.is_full:
+                return False
+            pug_start_success, msg = await self.start_pug()
+            if not pug_start_success:
+                return False
+            # Before starting pug and resetting queue, manually update
+            # presence, so we're guaranteed to have the presence status fully
+            # up-to-date here.
+            self.last_changed_presence = None
+            await self.update_presence()
+            # Ping the puggers
+            await self.guild_channel.send(msg)
+            # And finally reset the queue, so we're ready for the next PUGs.
+            await self.reset()
+            return True
+
+    def is_presence_throttled(self):
+        """Whether the presence was changed too recently to change again."""
+        if self.last_changed_presence is None:
+            return False
+        delta_time = time.monotonic() - self.last_changed_presence
+        return delta_time < PRESENCE_INTERVAL_SECS + 2
+
     async def update_presence(self):
         """Updates the bot's status message ("presence").
            This is used for displaying things like the PUG queue status.
         """
+        # Checking before taking the lock, since most calls are throttled.
+        if self.is_presence_throttled():
+            return
         async with self.lock:
-            delta_time = int(time.time()) - self.last_changed_presence
-
-            if delta_time < cfg("NTBOT_PRESENCE_INTERVAL_SECS") + 2:
+            # Someone else may have updated it while we were waiting.
+            if self.is_presence_throttled():
                 return
 
             presence = self.last_presence
@@ -369,12 +479,12 @@ class PugStatus():
                     text += "s"  # plural
                 else:
                     text += "!"  # need one more!
-                activity = discord.Activity(type=discord.ActivityType.watching,
-                                            name=text)
+                activity = presence_activity(discord.ActivityType.watching,
+                                             text)
             else:
                 text = "a PUG! 🐩"
-                activity = discord.Activity(type=discord.ActivityType.playing,
-                                            name=text)
+                activity = presence_activity(discord.ActivityType.playing,
+                                             text)
 
             presence["activity"] = activity
             presence["status"] = status
@@ -382,14 +492,15 @@ class PugStatus():
             await bot.change_presence(activity=presence["activity"],
                                       status=presence["status"])
             self.last_presence = presence
-            self.last_changed_presence = int(time.time())
+            self.last_changed_presence = time.monotonic()
+            self.dirty = False
 
     async def role_ping_deltatime(self):
         """Returns a datetime.timedelta of latest role ping, or None if no such
            ping was found.
         """
         after = pendulum.now().subtract(
-            hours=cfg("NTBOT_PUGGER_ROLE_PING_MIN_INTERVAL_HOURS"))
+            hours=PUGGER_ROLE_PING_MIN_INTERVAL_HOURS)
         # Because Pycord 1.7.3 wants non timezone aware "after" date.
         after = datetime.fromisoformat(after.in_timezone("UTC").isoformat())
         after = after.replace(tzinfo=None)
@@ -413,7 +524,7 @@ class PugStatus():
             # side error logs cleaner since the Discord bugs aren't really
             # actionable for us as the API user.
             if err.code == 0 and str(err.status)[:1] == "5":
-                return datetime.timedelta()
+                return timedelta()
             raise err
         return None
 
@@ -421,42 +532,73 @@ class PugStatus():
         """Pings the puggers Discord server role, if it's currently allowed.
            Frequency of these pings is restricted to avoid being too spammy.
         """
+        # Only snapshotting the queue under the lock, so that we won't hold it
+        # over the HTTP requests below.
         async with self.lock:
-            if self.num_more_needed == 0:
-                return
-
+            num_more_needed = self.num_more_needed
             pugger_ratio = self.num_queued / self.num_expected
-            ping_ratio = cfg("NTBOT_PUGGER_ROLE_PING_THRESHOLD")
-            if pugger_ratio < ping_ratio:
-                return
+            role = self.pugger_role
+        if num_more_needed == 0 or role is None:
+            return
+        if pugger_ratio < PUGGER_ROLE_PING_THRESHOLD:
+            return
+
+        last_ping_dt = await self.role_ping_deltatime()
+        if last_ping_dt is not None and \
+                last_ping_dt < PUGGER_ROLE_PING_MIN_INTERVAL:
+            return
 
-            last_ping_dt = await self.role_ping_deltatime()
-            hours_limit = cfg("NTBOT_PUGGER_ROLE_PING_MIN_INTERVAL_HOURS")
-            if last_ping_dt is not None:
-                last_ping_hours = last_ping_dt.total_seconds() / 60 / 60
-                if last_ping_hours < hours_limit:
-                    return
-
-            for role in self.guild_roles:
-                if role.name == PUGGER_ROLE:
-                    min_nag_hours = f"{hours_limit:.1f}"
-                    min_nag_hours = min_nag_hours.rstrip("0").rstrip(".")
-                    msg = (f"{role.mention} Need **"
-                           f"{self.num_more_needed} more puggers** "
-                           "for a game!\n_(This is an automatic ping "
-                           "to all puggers, because the PUG queue is "
-                           f"{(ping_ratio * 100):.0f}% full.\nRest "
-                           "assured, I will only ping you once per "
-                           f"{min_nag_hours} hours, at most.\n"
-                           "If you don't want any of these "
-                           "notifications, please consider "
-                           "temporarily muting this bot or leaving "
-                           f"the {role.mention} server role._)")
-                    await self.guild_channel.send(msg)
-                    break
+        min_nag_hours = f"{PUGGER_ROLE_PING_MIN_INTERVAL_HOURS:.1f}"
+        min_nag_hours = min_nag_hours.rstrip("0").rstrip(".")
+        msg = PUGGER_ROLE_PING_TEMPLATE.format(
+            mention=role.mention,
+            num_needed=num_more_needed,
+            percent=PUGGER_ROLE_PING_THRESHOLD * 100,
+            min_nag_hours=min_nag_hours)
+        await self.guild_channel.send(msg)
 
 
+# Keyed by guild id, so we won't keep stale guild objects alive.
 pug_guilds = {}
+# Each guild's PUG channel, kept up to date by the PugQueueCog listeners.
+pug_channels = {}
+
+
+def update_pug_channel(guild):
+    """Caches the PUG text channel of a guild, or drops the guild from the
+       cache if it doesn't have one.
+    """
+    channel = discord.utils.get(guild.text_channels, name=PUG_CHANNEL_NAME)
+    if channel is None:
+        pug_channels.pop(guild.id, None)
+    else:
+        pug_channels[guild.id] = channel
+
+
+def update_pug_roles(guild):
+    """Refreshes the guild roles known to the guild's PUG queue, if any."""
+    status = pug_guilds.get(guild.id)
+    if status is not None:
+        status.update_guild_roles(guild.roles)
+
+
+def is_pug_admin(member):
+    """Whether the guild member has any of the PUG admin roles."""
+    return not PUG_ADMIN_ROLES.isdisjoint(role.name for role in member.roles)
+
+
+def get_pug_status(ctx):
+    """Returns the guild's PugStatus, or None if not in its PUG channel."""
+    if ctx.guild is None:  # direct messages
+        return None
+    # The cached channel is kept up to date across renames by the listeners.
+    # Any other channels by the same name are accepted too, as before caching.
+    channel = pug_channels.get(ctx.guild.id)
+    if channel is None:
+        return None
+    if channel.id != ctx.channel.id and ctx.channel.name != PUG_CHANNEL_NAME:
+        return None
+    return pug_guilds.get(ctx.guild.id)
 
 
 @bot.command(brief="Test if bot is active")
@@ -471,32 +613,40 @@ async def ping(ctx):
 async def pug(ctx):
     """Player command for joining the PUG queue.
     """
-    if ctx.guild not in pug_guilds or not ctx.channel.name == PUG_CHANNEL_NAME:
+    status = get_pug_status(ctx)
+    if status is None:
         return
+    user = ctx.message.author
     response = ""
-    join_success, response = await pug_guilds[ctx.guild].player_join(
-        ctx.message.author)
+    join_success, response = await status.player_join(user)
     if join_success:
-        response = (f"{ctx.message.author.name} has joined the PUG queue "
-                    f"({pug_guilds[ctx.guild].num_queued} / "
-                    f"{pug_guilds[ctx.guild].num_expected})")
+        response = JOINED_QUEUE_TEMPLATE.format(
+            name=user.name, queued=status.num_queued,
+            expected=status.num_expected)
     await ctx.send(f"{response}")
+    if join_success:
+        # Start right away, instead of waiting for the next queue poll.
+        await status.start_pug_if_full()
+        await status.update_presence()
 
 
 @bot.command(brief="Leave the PUG queue")
 async def unpug(ctx):
     """Player command for leaving the PUG queue.
     """
-    if ctx.guild not in pug_guilds or not ctx.channel.name == PUG_CHANNEL_NAME:
+    status = get_pug_status(ctx)
+    if status is None:
         return
+    user = ctx.message.author
 
-    leave_success, msg = await pug_guilds[ctx.guild].player_leave(
-        ctx.message.author)
+    leave_success, msg = await status.player_leave(user)
     if leave_success:
-        msg = (f"{ctx.message.author.name} has left the PUG queue "
-               f"({pug_guilds[ctx.guild].num_queued} / "
-               f"{pug_guilds[ctx.guild].num_expected})")
+        msg = LEFT_QUEUE_TEMPLATE.format(name=user.name,
+                                         queued=status.num_queued,
+                                         expected=status.num_expected)
     await ctx.send(msg)
+    if leave_success:
+        await status.update_presence()
 
 
 @bot.command(brief="Empty the server's PUG queue")
@@ -504,23 +654,22 @@ async def clearpuggers(ctx):
     """Player command for clearing the PUG queue.
        This can be restricted to Discord guild specific admin roles.
     """
-    if ctx.guild not in pug_guilds or not ctx.channel.name == PUG_CHANNEL_NAME:
+    status = get_pug_status(ctx)
+    if status is None:
         return
+    user = ctx.message.author
 
     # If zero pug admin roles are configured, assume anyone can !clearpuggers
-    if len(cfg("NTBOT_PUG_ADMIN_ROLES")) == 0:
-        is_allowed = True
-    else:
-        pug_admin_roles = [role.value for role in cfg("NTBOT_PUG_ADMIN_ROLES")]
-        user_roles = [role.name for role in ctx.message.author.roles]
-        is_allowed = any(role in pug_admin_roles for role in user_roles)
+    is_allowed = not PUG_ADMIN_ROLES or is_pug_admin(user)
 
     if is_allowed:
-        await pug_guilds[ctx.guild].reset()
-        await ctx.send(f"{ctx.message.author.name} has reset the PUG queue")
+        await status.reset()
+        await ctx.send(f"{user.name} has reset the PUG queue")
+        await status.update_presence()
     else:
-        await ctx.send(f"{ctx.message.author.mention} The PUG queue can only "
-                       f"be reset by users with role(s): _{pug_admin_roles}_")
+        await ctx.send(f"{user.mention} The PUG queue can only "
+                       "be reset by users with role(s): "
+                       f"_{PUG_ADMIN_ROLE_NAMES}_")
 
 
 @bot.command(brief="Get new random teams suggestion for the latest PUG")
@@ -528,25 +677,27 @@ async def scramble(ctx):
     """Player command for scrambling the latest full PUG queue.
        Can be called multiple times for generating new random teams.
     """
+    # Unlike the queue commands, this works in any channel of the guild.
+    status = None if ctx.guild is None else pug_guilds.get(ctx.guild.id)
+    if status is None:
+        return
+    user = ctx.message.author
+
     msg = ""
-    if len(pug_guilds[ctx.guild].prev_puggers) == 0:
-        msg = (f"{ctx.message.author.mention} Sorry, no previous PUG found to "
+    prev = status.prev_puggers
+    if len(prev) == 0:
+        msg = (f"{user.mention} Sorry, no previous PUG found to "
                "scramble")
     else:
-        random.shuffle(pug_guilds[ctx.guild].prev_puggers)
-        msg = f"{ctx.message.author.name} suggests scrambled teams:\n"
+        random.shuffle(prev)
+        half = len(prev) // 2
+        msg = f"{user.name} suggests scrambled teams:\n"
         msg += f"_(random shuffle id: {random_human_readable_phrase()})_\n"
         msg += "\n_" + FIRST_TEAM_NAME + " players:_\n"
-        for i in range(int(len(pug_guilds[ctx.guild].prev_puggers) / 2)):
-            msg += f"{pug_guilds[ctx.guild].prev_puggers[i].name}, "
-        msg = msg[:-2]  # trailing ", "
+        msg += ", ".join(p.name for p in prev[:half])
         msg += "\n_" + SECOND_TEAM_NAME + " players:_\n"
-        for i in range(int(len(pug_guilds[ctx.guild].prev_puggers) / 2),
-                       len(pug_guilds[ctx.guild].prev_puggers)):
-            msg += f"{pug_guilds[ctx.guild].prev_puggers[i].name}, "
-        msg = msg[:-2]  # trailing ", "
-        msg += ("\n\nTeams still unbalanced? Use **"
-                f"{bot.command_prefix}scramble** to suggest new random teams.")
+        msg += ", ".join(p.name for p in prev[half:])
+        msg += SCRAMBLE_FOOTER
     await ctx.send(msg)
 
 
@@ -554,82 +705,74 @@ async def scramble(ctx):
 async def puggers(ctx):
     """Player command for listing players currently in the PUG queue.
     """
-    if ctx.guild not in pug_guilds or not ctx.channel.name == PUG_CHANNEL_NAME:
+    status = get_pug_status(ctx)
+    if status is None:
         return
 
-    msg = (f"{pug_guilds[ctx.guild].num_queued} / "
-           f"{pug_guilds[ctx.guild].num_expected} player(s) currently "
-           "queued")
+    msg = (f"{status.num_queued} / {status.num_expected} player(s) "
+           "currently queued")
 
-    if pug_guilds[ctx.guild].num_queued > 0:
-        all_players_queued = pug_guilds[ctx.guild].team1_players + \
-            pug_guilds[ctx.guild].team2_players
+    if status.num_queued > 0:
         msg += ": "
-        for player in all_players_queued:
-            msg += f"{player.name}, "
-        msg = msg[:-2]  # trailing ", "
+        msg += ", ".join(player.name for player in
+                         chain(status.team1_players, status.team2_players))
     await ctx.send(msg)
 
 
-@commands.cooldown(rate=1, per=cfg("NTBOT_PING_PUGGERS_COOLDOWN_SECS"),
+@commands.cooldown(rate=1, per=PING_PUGGERS_COOLDOWN_SECS,
                    type=commands.BucketType.user)
 @bot.command(brief="Ping all players currently queueing for PUG")
 async def ping_puggers(ctx):
     """Player command to ping all players currently inside the PUG queue.
     """
-    if ctx.guild not in pug_guilds or not ctx.channel.name == PUG_CHANNEL_NAME:
+    status = get_pug_status(ctx)
+    if status is None:
         # Don't set cooldown for failed invocations.
         ping_puggers.reset_cooldown(ctx)
         return
 
-    pug_admin_roles = [role.value for role in cfg("NTBOT_PUG_ADMIN_ROLES")]
-    user_roles = [role.name for role in ctx.message.author.roles]
-    is_admin = any(role in pug_admin_roles for role in user_roles)
+    user = ctx.message.author
+    is_admin = is_pug_admin(user)
 
     # Only admins and players in the queue themselves are allowed to ping queue
     if not is_admin:
-        if ctx.message.author not in pug_guilds[ctx.guild].team1_players and \
-                ctx.message.author not in pug_guilds[ctx.guild].team2_players:
-            if pug_guilds[ctx.guild].num_queued == 0:
-                await ctx.send(f"{ctx.author.mention} PUG queue is currently "
+        if not status.is_queued(user):
+            if status.num_queued == 0:
+                await ctx.send(f"{user.mention} PUG queue is currently "
                                "empty.")
             else:
-                await ctx.send(f"{ctx.author.mention} Sorry, to be able to "
+                await ctx.send(f"{user.mention} Sorry, to be able to "
                                "ping the PUG queue, you have to be queued "
                                "yourself, or have the role(s): "
-                               f"_{pug_admin_roles}_")
+                               f"_{PUG_ADMIN_ROLE_NAMES}_")
             ping_puggers.reset_cooldown(ctx)
             return
 
-    async with pug_guilds[ctx.guild].lock:
-        # Comparing <=1 instead of 0 because it makes no sense to ping others
-        # if you're the only one currently in the queue.
-        if pug_guilds[ctx.guild].num_queued <= 1:
-            await ctx.send(f"{ctx.author.mention} There are no other players "
-                           "in the queue to ping!")
-            ping_puggers.reset_cooldown(ctx)
-            return
+    # Snapshot the queue, so we don't need to hold the lock while messaging.
+    async with status.lock:
+        all_players_queued = status.team1_players + status.team2_players
+
+    # Comparing <=1 instead of 0 because it makes no sense to ping others
+    # if you're the only one currently in the queue.
+    if len(all_players_queued) <= 1:
+        await ctx.send(f"{user.mention} There are no other players "
+                       "in the queue to ping!")
+        ping_puggers.reset_cooldown(ctx)
+        return
 
     # Require an info message instead of forcing pingees to spend time figuring
     # out why they were pinged. We will construct a jump_url to this message.
     args = ctx.message.content.split(" ", maxsplit=1)
     if len(args) <= 1 or len(args[1].strip()) == 0:
-        await ctx.send(f"{ctx.author.mention} Please include a message after "
+        await ctx.send(f"{user.mention} Please include a message after "
                        "the command, describing why you pinged the PUG queue.")
         ping_puggers.reset_cooldown(ctx)
         return
 
-    msg = ""
-    async with pug_guilds[ctx.guild].lock:
-        for player in [p for p in pug_guilds[ctx.guild].team1_players
-                       if p != ctx.author]:
-            msg += f"{player.mention}, "
-        for player in [p for p in pug_guilds[ctx.guild].team2_players
-                       if p != ctx.author]:
-            msg += f"{player.mention}, "
-        msg = msg[:-2]  # trailing ", "
-
-    msg += (f" User {ctx.author.mention} is pinging the PUG queue: "
+    msg = ", ".join(player.mention for player in all_players_queued
+                    if player != user)
+
+    msg += (f" User {user.mention} is pinging the PUG queue: "
             f"{ctx.message.jump_url}")
     await ctx.send(msg)
     # No cooldown for admin pings.
@@ -637,22 +780,25 @@ async def ping_puggers(ctx):
         ping_puggers.reset_cooldown(ctx)
 
 
+def load_phrase_words(filename):
+    """Returns the lowercased, non-empty words of a phrase_gen word file."""
+    path = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                        "static", "phrase_gen", filename)
+    with open(file=path, mode="r", encoding="utf-8") as f_words:
+        return tuple(line.strip().lower() for line in f_words if line.strip())
+
+
+# The word lists don't change at runtime, so only read them in once.
+PHRASE_NOUNS = load_phrase_words("nouns.txt")
+PHRASE_ADJECTIVES = load_phrase_words("adjectives.txt")
+
+
 def random_human_readable_phrase():
     """Generates a random human readable phrase to work as an identifier.
        Can be used for the !scrambles, to make it easier for players to refer
        to specific scramble permutations via voice chat by using these phrases.
     """
-    base_path = os.path.join(os.path.dirname(os.path.realpath(__file__)),
-                             "static", "phrase_gen")
-    with open(file=os.path.join(base_path, "nouns.txt"), mode="r",
-              encoding="utf-8") as f_nouns:
-        nouns = f_nouns.readlines()
-    with open(file=os.path.join(base_path, "adjectives.txt"), mode="r",
-              encoding="utf-8") as f_adjs:
-        adjectives = f_adjs.readlines()
-    phrase = (f"{adjectives[random.randint(0, len(adjectives) - 1)]} "
-              f"{nouns[random.randint(0, len(nouns) - 1)]}")
-    return phrase.replace("\n", "").lower()
+    return f"{random.choice(PHRASE_ADJECTIVES)} {random.choice(PHRASE_NOUNS)}"
 
 
 class ErrorHandlerCog(commands.Cog):
@@ -685,16 +831,16 @@ class PugQueueCog(commands.Cog):
     """PUG queue main event loop.
     """
     def __init__(self, parent_bot):
-        """Acquire lock for asynchronous queue polling,
-           and start the queue loop.
-        """
+        """Set up the per-guild locks, and start the task loops."""
         # pylint: disable=no-member
         self.bot = parent_bot
-        self.lock = asyncio.Lock()
+        self.guild_locks = defaultdict(asyncio.Lock)
+        # Cap concurrent guild polls, to stay clear of the API rate limits.
+        self.poll_semaphore = asyncio.Semaphore(8)
         self.poll_queue.start()
         self.clear_inactive_puggers.start()
 
-    @tasks.loop(seconds=cfg("NTBOT_POLLING_INTERVAL_SECS"))
+    @tasks.loop(seconds=POLLING_INTERVAL_SECS)
     async def poll_queue(self):
         """Poll the PUG queue to see if we're ready to play,
            and to possibly update our status in various ways.
@@ -703,50 +849,145 @@ class PugQueueCog(commands.Cog):
            channels simultaneously using the same bot instance with their
            own independent player pools.
         """
-        async with self.lock:
-            for guild in bot.guilds:
-                for channel in guild.channels:
-                    if channel.name != PUG_CHANNEL_NAME:
-                        continue
-                    if guild not in pug_guilds:
-                        pug_guilds[guild] = PugStatus(guild_channel=channel,
-                                                      guild_roles=guild.roles)
-                        await pug_guilds[guild].reload_puggers()
-                    if pug_guilds[guild].is_full:
-                        pug_start_success, msg = \
-                            await pug_guilds[guild].start_pug()
-                        if pug_start_success:
-                            # Before starting pug and resetting queue, manually
-                            # update presence, so we're guaranteed to have the
-                            # presence status fully up-to-date here.
-                            pug_guilds[guild].last_changed_presence = 0
-                            await pug_guilds[guild].update_presence()
-                            # Ping the puggers
-                            await channel.send(msg)
-                            # And finally reset the queue, so we're ready for
-                            # the next PUGs.
-                            await pug_guilds[guild].reset()
-                    else:
-                        await pug_guilds[guild].update_presence()
-                        await pug_guilds[guild].ping_role()
+        # Copying, because the channel event listeners may modify the
+        # cache while we're awaiting in here.
+        await asyncio.gather(*(self.poll_guild(guild_id)
+                               for guild_id in list(pug_channels)))
+
+        # Poll less frequently while the queues are idle. A new interval only
+        # applies after the already scheduled iteration, so speeding up lags
+        # by one slow cycle; fine, since the commands start PUGs themselves.
+        fill_ratio = max((status.num_queued / status.num_expected
+                          for status in pug_guilds.values()), default=0)
+        if fill_ratio > POLLING_BUSY_FILL_RATIO:
+            interval = POLLING_INTERVAL_SECS
+        elif fill_ratio > 0:
+            interval = (POLLING_INTERVAL_SECS *
+                        POLLING_PARTIAL_INTERVAL_MULTIPLIER)
+        else:
+            interval = POLLING_INTERVAL_SECS * POLLING_IDLE_INTERVAL_MULTIPLIER
+        if self.poll_queue.seconds != interval:
+            self.poll_queue.change_interval(seconds=interval)
+
+    async def poll_guild(self, guild_id):
+        """Poll the PUG queue of a single guild, under its own lock, so that
+           a slow guild won't hold up the polling of the others.
+        """
+        async with self.poll_semaphore, self.guild_locks[guild_id]:
+            status = pug_guilds.get(guild_id)
+            # The queues are set up by the event listeners, not in here.
+            if status is None:
+                return
+            # Don't let a Discord API error in one guild stop the polling
+            # loop for all of them. We'll just try again on the next poll.
+            try:
+                if status.is_full:
+                    # Normally the pug command will have already started
+                    # this, but this is a safety net for any missed starts.
+                    await status.start_pug_if_full()
+                else:
+                    # Presence only needs updating if the queue has changed.
+                    if status.dirty:
+                        await status.update_presence()
+                    await status.ping_role()
+            except discord.errors.HTTPException as err:
+                print(f"Failed to poll the PUG queue of guild {guild_id}: "
+                      f"{err}")
+
+    @poll_queue.before_loop
+    async def before_poll_queue(self):
+        """Don't start polling until the bot's guild cache is populated."""
+        await self.bot.wait_until_ready()
+
+    async def setup_pug_guild(self, guild):
+        """Caches the guild's PUG channel, and if this is the first time we
+           see it, creates its PUG queue and restores the queued players.
+           Forgets the PUG queue of a guild that no longer has a PUG channel.
+        """
+        update_pug_channel(guild)
+        channel = pug_channels.get(guild.id)
+        async with self.guild_locks[guild.id]:
+            if channel is None:
+                # Nowhere left to play in. Should the PUG channel come back,
+                # the queue gets restored from its history as on restart.
+                pug_guilds.pop(guild.id, None)
+                return
+            if guild.id in pug_guilds:
+                # The PUG channel may have been re-created since.
+                pug_guilds[guild.id].guild_channel = channel
+                return
+            pug_guilds[guild.id] = PugStatus(guild_channel=channel,
+                                             guild_roles=guild.roles)
+            await pug_guilds[guild.id].reload_puggers()
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        """Set up the PUG queues upon (re)connecting."""
+        for guild in self.bot.guilds:
+            # Don't let a Discord API error in one guild stop us from setting
+            # up the rest of them. The hourly clear_inactive_puggers() will
+            # retry restoring its queue.
+            try:
+                await self.setup_pug_guild(guild)
+            except discord.errors.HTTPException as err:
+                print(f"Failed to set up the PUG queue of guild {guild.id}: "
+                      f"{err}")
+
+    @commands.Cog.listener()
+    async def on_guild_join(self, guild):
+        """Set up the PUG queue of a newly joined guild."""
+        await self.setup_pug_guild(guild)
+
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild):
+        """Forget about the PUG queue of a guild we're no longer in."""
+        pug_channels.pop(guild.id, None)
+        pug_guilds.pop(guild.id, None)
+        self.guild_locks.pop(guild.id, None)
+
+    @commands.Cog.listener("on_guild_channel_create")
+    @commands.Cog.listener("on_guild_channel_delete")
+    async def on_guild_channel_change(self, channel):
+        """Check whether the PUG channel was created or deleted."""
+        await self.setup_pug_guild(channel.guild)
+
+    @commands.Cog.listener()
+    async def on_guild_channel_update(self, before, after):
+        """Check whether a channel was renamed to or from the PUG channel."""
+        if before.name != after.name:
+            await self.setup_pug_guild(after.guild)
+
+    @commands.Cog.listener("on_guild_role_create")
+    @commands.Cog.listener("on_guild_role_delete")
+    async def on_guild_role_change(self, role):
+        """Check whether the pugger role was created or deleted."""
+        update_pug_roles(role.guild)
+
+    @commands.Cog.listener()
+    async def on_guild_role_update(self, before, after):
+        """Check whether a role was renamed to or from the pugger role."""
+        if before.name != after.name:
+            update_pug_roles(after.guild)
 
     @tasks.loop(hours=1)
     async def clear_inactive_puggers(self):
         """Periodically clear inactive puggers from the queue(s).
         """
-        async with self.lock:
-            for guild in bot.guilds:
-                if guild not in pug_guilds:
+        # Like poll_queue, only visiting guilds that have a PUG channel.
+        for guild_id in list(pug_channels):
+            async with self.guild_locks[guild_id]:
+                status = pug_guilds.get(guild_id)
+                if status is None or status.is_full:
                     continue
-                if pug_guilds[guild].is_full:
-                    continue
-                for channel in guild.channels:
-                    if channel.name != PUG_CHANNEL_NAME:
-                        continue
-                    await pug_guilds[guild].reload_puggers()
-                    break
+                await status.reload_puggers()
+
+    @clear_inactive_puggers.before_loop
+    async def before_clear_inactive_puggers(self):
+        """Don't start clearing until the bot's guild cache is populated."""
+        await self.bot.wait_until_ready()
 
 
-bot.add_cog(ErrorHandlerCog(bot))
-bot.add_cog(PugQueueCog(bot))
-bot.run(BOT_SECRET_TOKEN)
+if __name__ == "__main__":
+    bot.add_cog(ErrorHandlerCog(bot))
+    bot.add_cog(PugQueueCog(bot))
+    bot.run(BOT_SECRET_TOKEN)